@@ -0,0 +1,458 @@
+"""Sentiment analysis of reviews with the GROQ API, shared by the API applications."""
+import hashlib
+import heapq
+import logging
+import os
+import random
+import re
+import time
+import asyncio
+from collections import Counter, deque
+from functools import lru_cache
+from typing import IO, Any, Deque, Dict, List, Mapping, Optional, Tuple
+
+import httpx
+import pandas as pd
+import tiktoken
+from dotenv import load_dotenv
+from groq import APIStatusError, AsyncGroq
+from python_calamine import CalamineError
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# HTTP client shared by all the requests to GROQ. HTTP/2 and a large keep-alive pool let the concurrent chunk requests reuse the same connections instead of opening a new TLS connection for each one.
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+    timeout=httpx.Timeout(60.0, connect=5.0),
+)
+# The SDK retries are disabled, since every retry has to go through the rate limiter to be counted in its windows. process_chunk does the retrying instead.
+groq_client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), http_client=http_client, max_retries=0)
+
+# Maximum number of chunks sent to the LLM at the same time
+MAX_CONCURRENT_CHUNKS = 8
+
+# Rate limits of the GROQ account. They are not enforced when unset, the token limit is then learnt from the response headers.
+# GROQ only reports its daily request limit in the headers, so a per minute request limit has to be configured explicitly.
+GROQ_REQUESTS_PER_MINUTE = int(os.getenv("GROQ_REQUESTS_PER_MINUTE", "0")) or None
+GROQ_TOKENS_PER_MINUTE = int(os.getenv("GROQ_TOKENS_PER_MINUTE", "0")) or None
+
+# Number of server worker processes (the variable uvicorn and gunicorn read). Every worker has its own copy of the module state (clients, cache and rate limiter), created when it imports this module, and gets an even share of the rate limits.
+SERVER_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# The encoder is built once and reused, since constructing the BPE tables is far more expensive than encoding a review
+@lru_cache(maxsize=1)
+def _get_encoder() -> tiktoken.Encoding:
+    """Returns the shared tiktoken encoder, building it on first use."""
+    return tiktoken.encoding_for_model("gpt-3.5-turbo")
+
+# Function to calculate the number of tokens in each of the text strings
+# This is required to ensure that minimum number of requests are made to the LLM. This saves the number of requests and resources. This helps in undersanding how many chunks should the input reviews be divided into.
+# tiktoken tokenizes the batch across threads in Rust, which is much faster than encoding the reviews one at a time
+def num_tokens_from_strings(strings: List[str]) -> List[int]:
+    """Returns the number of tokens in each of the given text strings."""
+    encoded = _get_encoder().encode_ordinary_batch(strings, num_threads=os.cpu_count() or 1)
+    return [len(tokens) for tokens in encoded]
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parses a rate limit header such as '2m59.56s' or '7' into seconds."""
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if parts:
+        return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def _parse_int(value: Optional[str]) -> Optional[int]:
+    """Parses an integer rate limit header, returning None when it is missing or malformed."""
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+class RateLimiter:
+    """Keeps the requests sent to the LLM within the provider's rate limits.
+
+    Requests and tokens are tracked over a sliding one minute window, and the
+    limits reported in the x-ratelimit-* response headers are honoured before a
+    request is sent. The number of requests in flight is adjusted with AIMD:
+    it grows additively after each success and is cut multiplicatively when
+    the provider throttles us (429) or fails (5xx).
+    """
+
+    WINDOW_SECONDS = 60.0
+
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None,
+                 max_concurrency: int = 8, increase: float = 1.0, decrease: float = 0.5, processes: int = 1):
+        # The account limits are split evenly between the server processes, each of which has its own limiter.
+        # When there are more processes than requests per minute, each process gets one request per longer window, so that together they stay within the limit.
+        self.processes = max(1, processes)
+        self.requests_per_window: Optional[int] = None
+        self.request_window_seconds = self.WINDOW_SECONDS
+        if requests_per_minute:
+            share = requests_per_minute / self.processes
+            if share >= 1:
+                self.requests_per_window = int(share)
+            else:
+                self.requests_per_window = 1
+                self.request_window_seconds = self.WINDOW_SECONDS / share
+        self.tokens_per_minute = max(1, tokens_per_minute // self.processes) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.increase = increase
+        self.decrease = decrease
+        self.concurrency = float(max_concurrency)
+        self._in_flight = 0
+        self._request_times: Deque[float] = deque()
+        self._token_usage: Deque[Tuple[float, int]] = deque()
+        self._window_tokens = 0
+        self._remaining_requests: Optional[int] = None
+        self._remaining_tokens: Optional[int] = None
+        self._requests_reset_at = 0.0
+        self._tokens_reset_at = 0.0
+        self._retry_at = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Created lazily so that it is bound to the event loop serving the requests
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        """Waits for a free concurrency slot and for the rate limits to allow the request."""
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self._in_flight < max(1, int(self.concurrency)))
+            self._in_flight += 1
+        try:
+            await self.wait_if_throttled(estimated_tokens)
+        except BaseException:
+            async with condition:
+                self._in_flight -= 1
+                condition.notify_all()
+            raise
+
+    async def release(self, throttled: bool = False) -> None:
+        """Frees the slot taken by acquire() and applies the AIMD update to the concurrency limit."""
+        condition = self._get_condition()
+        async with condition:
+            self._in_flight -= 1
+            if throttled:
+                self.concurrency = max(1.0, self.concurrency * self.decrease)
+            else:
+                self.concurrency = min(float(self.max_concurrency), self.concurrency + self.increase)
+            condition.notify_all()
+
+    def _get_delay(self, estimated_tokens: int, now: float) -> float:
+        while self._request_times and self._request_times[0] <= now - self.request_window_seconds:
+            self._request_times.popleft()
+        while self._token_usage and self._token_usage[0][0] <= now - self.WINDOW_SECONDS:
+            self._window_tokens -= self._token_usage.popleft()[1]
+
+        delay = self._retry_at - now
+        if self.requests_per_window and len(self._request_times) >= self.requests_per_window:
+            delay = max(delay, self._request_times[0] + self.request_window_seconds - now)
+        if self.tokens_per_minute and self._token_usage and self._window_tokens + estimated_tokens > self.tokens_per_minute:
+            delay = max(delay, self._token_usage[0][0] + self.WINDOW_SECONDS - now)
+        if self._remaining_requests is not None and self._remaining_requests <= 0:
+            delay = max(delay, self._requests_reset_at - now)
+        if self._remaining_tokens is not None and self._remaining_tokens < estimated_tokens:
+            delay = max(delay, self._tokens_reset_at - now)
+        return delay
+
+    async def wait_if_throttled(self, estimated_tokens: int) -> None:
+        """Sleeps until the request fits within the rate limits, then records it in the window."""
+        while True:
+            now = time.monotonic()
+            delay = self._get_delay(estimated_tokens, now)
+            if delay <= 0:
+                break
+            logger.info(f"Rate limit budget exhausted. Waiting for {delay:.2f} seconds before sending the request.")
+            await asyncio.sleep(delay)
+
+        self._request_times.append(now)
+        self._token_usage.append((now, estimated_tokens))
+        self._window_tokens += estimated_tokens
+        if self._remaining_requests is not None:
+            self._remaining_requests -= 1
+        if self._remaining_tokens is not None:
+            self._remaining_tokens -= estimated_tokens
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """Updates the limiter with the x-ratelimit-* and retry-after headers of a response."""
+        now = time.monotonic()
+
+        # Groq reports the token limit per minute (the request limit is per day, so it is only used through the remaining count)
+        tokens_per_minute = _parse_int(headers.get("x-ratelimit-limit-tokens"))
+        if tokens_per_minute:
+            self.tokens_per_minute = max(1, tokens_per_minute // self.processes)
+
+        remaining_requests = _parse_int(headers.get("x-ratelimit-remaining-requests"))
+        if remaining_requests is not None:
+            self._remaining_requests = remaining_requests
+            self._requests_reset_at = now + (_parse_duration(headers.get("x-ratelimit-reset-requests")) or 0.0)
+
+        remaining_tokens = _parse_int(headers.get("x-ratelimit-remaining-tokens"))
+        if remaining_tokens is not None:
+            self._remaining_tokens = remaining_tokens
+            self._tokens_reset_at = now + (_parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0.0)
+
+        retry_after = _parse_duration(headers.get("retry-after"))
+        if retry_after:
+            self._retry_at = max(self._retry_at, now + retry_after)
+
+# Rate limiter shared by all the requests sent to the LLM, so that chunks are throttled before they hit the provider limits instead of after
+rate_limiter = RateLimiter(
+    requests_per_minute=GROQ_REQUESTS_PER_MINUTE,
+    tokens_per_minute=GROQ_TOKENS_PER_MINUTE,
+    max_concurrency=MAX_CONCURRENT_CHUNKS,
+    processes=SERVER_WORKERS,
+)
+
+# Instructions sent as the system message of every request. They are identical for all the chunks and come before the reviews, so providers which cache prompt prefixes can reuse them instead of processing them again.
+SENTIMENT_INSTRUCTIONS = "Analyze the sentiment of each of the following reviews and classify each as positive, negative, or neutral. Also provide a confidence score between 0 and 1 for each. Return the results in the format: 'classification,score' for each review, separated by newlines."
+
+# Maximum number of tokens of the LLM response, and an upper estimate of the tokens of each 'classification,score' line in it (including any numbering)
+MAX_RESPONSE_TOKENS = 2000
+TOKENS_PER_RESULT = 10
+
+# Function to send a prompt to the LLM through the rate limiter
+async def create_chat_completion(prompt: str, estimated_tokens: int):
+    """Sends the reviews prompt to the LLM once the rate limiter allows it and feeds the outcome back to the limiter."""
+    await rate_limiter.acquire(estimated_tokens)
+    throttled = False
+    try:
+        raw_response = await groq_client.chat.completions.with_raw_response.create(
+            messages=[
+                {
+                    "role": "system",
+                    "content": SENTIMENT_INSTRUCTIONS,
+                },
+                {
+                    "role": "user",
+                    "content": prompt,
+                }
+            ],
+            model="mixtral-8x7b-32768",
+            temperature=0,
+            max_tokens=MAX_RESPONSE_TOKENS,
+        )
+        rate_limiter.update_from_headers(raw_response.headers)
+        return await raw_response.parse()
+    except APIStatusError as e:
+        rate_limiter.update_from_headers(e.response.headers)
+        throttled = e.status_code == 429 or e.status_code >= 500
+        raise
+    finally:
+        await rate_limiter.release(throttled)
+
+# Cache of review -> (sentiment, score) keyed by a hash of the review text, so that reviews seen before are not sent to the LLM again
+SENTIMENT_CACHE_SIZE = int(os.getenv("SENTIMENT_CACHE_SIZE", "100000"))
+_SENTIMENT_CACHE: Dict[bytes, Tuple[str, float]] = {}
+
+def _review_cache_key(review: str) -> bytes:
+    """Returns the sentiment cache key of a review."""
+    return hashlib.blake2b(review.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+def _cache_sentiment(key: bytes, result: Tuple[str, float]) -> None:
+    """Stores a result in the sentiment cache, evicting the oldest entry once the cache is full."""
+    if key not in _SENTIMENT_CACHE and len(_SENTIMENT_CACHE) >= SENTIMENT_CACHE_SIZE:
+        del _SENTIMENT_CACHE[next(iter(_SENTIMENT_CACHE))]
+    _SENTIMENT_CACHE[key] = result
+
+# Pattern of a 'classification,score' line in the LLM response. It tolerates numbering, extra spaces and punctuation around the result.
+_RESULT_PATTERN = re.compile(r"(positive|negative|neutral)\s*[,:]\s*([01](?:\.\d+)?)", re.IGNORECASE)
+
+# Function to chunk the reviews into smaller chunks to ensure that the input does not exceed the token limit of the model (context window)
+# The longest reviews are placed first, each into the chunk with the most room left, which packs the reviews into fewer chunks (and so fewer requests) than filling the chunks in order
+# The number of reviews per chunk can also be capped, since the model has to answer every review of a chunk within its response limit
+def chunk_reviews(token_counts: List[int], budget: int, max_reviews: Optional[int] = None) -> List[Tuple[List[int], int]]:
+    """Groups the review indices into chunks of at most budget tokens and max_reviews reviews, returning each chunk with its token count.
+
+    A review longer than the budget is placed in a chunk of its own.
+    """
+    chunk_indices: List[List[int]] = []
+    chunk_tokens: List[int] = []
+    free_space = [] # max-heap of (-remaining tokens, chunk id) of the chunks which can take more reviews
+
+    for i in sorted(range(len(token_counts)), key=token_counts.__getitem__, reverse=True):
+        review_tokens = token_counts[i]
+        if free_space and -free_space[0][0] >= review_tokens:
+            remaining, chunk_id = heapq.heappop(free_space)
+            chunk_indices[chunk_id].append(i)
+            chunk_tokens[chunk_id] += review_tokens
+            if max_reviews is None or len(chunk_indices[chunk_id]) < max_reviews:
+                heapq.heappush(free_space, (remaining + review_tokens, chunk_id))
+        else:
+            chunk_indices.append([i])
+            chunk_tokens.append(review_tokens)
+            if max_reviews is None or max_reviews > 1:
+                heapq.heappush(free_space, (review_tokens - budget, len(chunk_indices) - 1))
+
+    # Keeping the reviews of each chunk in their original order
+    return [(sorted(indices), tokens) for indices, tokens in zip(chunk_indices, chunk_tokens)]
+
+# Function to analyze the sentiments of a batch of reviews
+async def analyze_sentiments_batch(reviews: List[str], max_retries: int = 5) -> List[Optional[Tuple[str, float]]]:
+    MAX_TOKENS = 32768 # Mistral 7B token limit
+    RESERVE_TOKENS = 2000 # Reserving for prompt and response
+
+    # Function to process a chunk of reviews
+    async def process_chunk(chunk: List[str], chunk_tokens: int) -> List[Tuple[str, float]]:
+
+        # Formatting the reviews in the format {count}. {review} to be used as a prompt for the model
+        # The pieces are collected in a single list and joined once, instead of formatting a temporary string per review
+        parts = []
+        parts_append = parts.append
+        for i, review in enumerate(chunk, 1):
+            parts_append(str(i))
+            parts_append(". ")
+            parts_append(review)
+            parts_append("\n")
+        chunk_text = "".join(parts)
+
+        # Defining the variable part of the prompt, the instructions are sent separately as the system message
+        reviews_prompt = f"""Reviews:
+{chunk_text}
+Results:"""
+
+        # Starting the processing of the chunk
+        for attempt in range(max_retries):
+            try:
+                response = await create_chat_completion(reviews_prompt, chunk_tokens + RESERVE_TOKENS)
+                response_text = response.choices[0].message.content
+                results = [(m.group(1).lower(), float(m.group(2))) for line in response_text.splitlines() if (m := _RESULT_PATTERN.search(line))]
+                if not results:
+                    raise ValueError("No sentiment could be parsed from the response")
+                return results
+            except Exception as e:
+                logger.warning(f"Attempt {attempt + 1} failed: {str(e)}")
+
+                # Handling the rate limit and server errors by waiting for a certain time before retrying
+                if "rate limit" in str(e).lower() or (isinstance(e, APIStatusError) and e.status_code >= 500):
+                    wait_time = 2 ** attempt + random.uniform(0, 1) # Exponential Wait with jitter so that concurrent chunks do not retry in lockstep
+                    logger.info(f"Rate limit reached. Waiting for {wait_time:.2f} seconds before retrying.")
+                    await asyncio.sleep(wait_time)
+                elif attempt == max_retries - 1:
+                    logger.error(f"All attempts failed for chunk processing.")
+                    return [] # Return empty list in case of failure
+                    
+        logger.error(f"All attempts failed for chunk processing.")
+        return [] 
+
+    # Reviews analysed before are answered from the cache, only the new ones are sent to the LLM
+    # The new reviews are also deduplicated, so a review repeated in the batch is sent once and its result is copied to every occurrence
+    results: List[Optional[Tuple[str, float]]] = [None] * len(reviews)
+    missing: Dict[bytes, List[int]] = {} # cache key -> positions of the review in the batch
+    for i, review in enumerate(reviews):
+        key = _review_cache_key(review)
+        cached = _SENTIMENT_CACHE.get(key)
+        if cached is None:
+            missing.setdefault(key, []).append(i)
+        else:
+            results[i] = cached
+    if not missing:
+        return results
+    missing_keys = list(missing)
+    missing_reviews = [reviews[missing[key][0]] for key in missing_keys]
+
+    # Processing the reviews in chunks
+    # Tokenization is CPU bound, so it runs in a worker thread to keep the event loop free for other requests
+    token_counts = await asyncio.to_thread(num_tokens_from_strings, missing_reviews)
+    # The reviews per chunk are also capped so that the model can answer all of them within the response limit, otherwise the response is cut short and the chunk discarded
+    chunks = chunk_reviews(token_counts, MAX_TOKENS - RESERVE_TOKENS, MAX_RESPONSE_TOKENS // TOKENS_PER_RESULT) # chunk creation
+
+    # The chunks are independent, so they are sent to the LLM concurrently. The rate limiter caps the number of requests in flight to stay within the provider limits.
+    chunk_results = await asyncio.gather(
+        *(process_chunk([missing_reviews[i] for i in indices], chunk_tokens) for indices, chunk_tokens in chunks),
+        return_exceptions=True,
+    )
+
+    # Placing the results back at the position of their review. Reviews of failed chunks are left as None.
+    for (indices, _), chunk_result in zip(chunks, chunk_results):
+        if isinstance(chunk_result, Exception):
+            logger.error(f"Chunk processing raised an error: {str(chunk_result)}")
+            continue
+
+        # Results can only be matched to their reviews by position, so a chunk where the LLM did not answer every review is treated as failed
+        if len(chunk_result) != len(indices):
+            logger.warning(f"Expected {len(indices)} results for the chunk but received {len(chunk_result)}, discarding them.")
+            continue
+        for i, result in zip(indices, chunk_result):
+            key = missing_keys[i]
+            for position in missing[key]:
+                results[position] = result
+            _cache_sentiment(key, result)
+    
+    return results
+
+# Function to process the reviews and return the sentiment counts and the top comments of each sentiment
+async def process_reviews(reviews: List[str]) -> Dict[str, Any]:
+    results = await analyze_sentiments_batch(reviews)
+    counts = Counter()
+    # min-heaps of (score, review) holding the 3 highest scoring reviews of each sentiment
+    top_comments = {
+        "positive": [],
+        "negative": [],
+        "neutral": []
+    }
+    
+    for review, result in zip(reviews, results):
+        if not result:
+            continue
+        sentiment, score = result
+        counts[sentiment] += 1
+        heap = top_comments[sentiment]
+        if len(heap) < 3:
+            heapq.heappush(heap, (score, review))
+        elif score > heap[0][0]:
+            heapq.heapreplace(heap, (score, review))
+    
+    sentiment_counts = {
+        "positive": counts["positive"],
+        "negative": counts["negative"],
+        "neutral": counts["neutral"]
+    }
+    
+    return {
+        "sentiment_counts": sentiment_counts,
+        "top_comments": {k: [r for _, r in sorted(v, reverse=True)] for k, v in top_comments.items()}
+    }
+
+# Names accepted for the header of the review column
+_HEADER_NAMES = {"review", "reviews"}
+
+# Function to read the reviews from an uploaded XLSX or CSV file
+# The pyarrow (CSV) and calamine (XLSX) engines are native parsers and are much faster than the default ones
+def read_reviews(source: IO[bytes], filename: str) -> List[str]:
+    """Returns the reviews in the first column of the file, without the header and empty cells.
+
+    Raises ValueError when the file cannot be parsed or has no columns.
+    """
+    source.seek(0)
+    try:
+        if filename.endswith('.xlsx'):
+            df = pd.read_excel(source, header=None, usecols=[0], dtype="string", engine="calamine")
+        else:
+            df = pd.read_csv(source, header=None, usecols=[0], dtype="string", engine="pyarrow")
+    except CalamineError as e:
+        # calamine errors do not derive from ValueError like the pandas and pyarrow parse errors
+        raise ValueError(str(e)) from e
+    if df.shape[1] == 0:
+        raise ValueError("The file has no columns")
+
+    reviews = df.iloc[:, 0].dropna().tolist()
+
+    # Handling the case where the first row is the header. The cell is normalised first, since spreadsheets often add a BOM, quotes or spaces around it.
+    if reviews and reviews[0].strip().lstrip("\ufeff").strip('"\'').lower() in _HEADER_NAMES:
+        del reviews[0]
+    return reviews
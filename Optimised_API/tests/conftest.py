@@ -0,0 +1,6 @@
+import os
+import sys
+
+# sentiment_core creates the GROQ client on import, which requires an API key
+os.environ.setdefault("GROQ_API_KEY", "test-key")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
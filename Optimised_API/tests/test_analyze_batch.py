@@ -0,0 +1,68 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import sentiment_core
+from main_app import app
+from sentiment_core import MAX_RESPONSE_TOKENS, TOKENS_PER_RESULT, analyze_sentiments_batch
+
+
+class FakeCompletion:
+    """Stands in for the LLM, answering 'negative' for reviews containing 'bad' and 'positive' otherwise."""
+
+    def __init__(self, drop=0):
+        self.drop = drop
+        self.prompts = []
+
+    async def __call__(self, prompt, estimated_tokens):
+        self.prompts.append(prompt)
+        reviews = [line.split(". ", 1)[1] for line in prompt.splitlines() if ". " in line]
+        lines = ["negative,0.8" if "bad" in review else "positive,0.9" for review in reviews]
+        content = "\n".join(lines[:len(lines) - self.drop])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+@pytest.fixture
+def completion(monkeypatch):
+    fake = FakeCompletion()
+    monkeypatch.setattr(sentiment_core, "create_chat_completion", fake)
+    # One token per word, so that the tests do not need the tiktoken encoding files
+    monkeypatch.setattr(sentiment_core, "num_tokens_from_strings", lambda strings: [len(s.split()) for s in strings])
+    monkeypatch.setattr(sentiment_core, "_SENTIMENT_CACHE", {})
+    return fake
+
+
+def test_duplicate_reviews_are_sent_once_and_share_the_result(completion):
+    results = asyncio.run(analyze_sentiments_batch(["Great", "bad service", "Great"]))
+    assert results == [("positive", 0.9), ("negative", 0.8), ("positive", 0.9)]
+    assert len(completion.prompts) == 1
+    assert completion.prompts[0].count("Great") == 1
+
+
+def test_cached_reviews_are_not_sent_again(completion):
+    asyncio.run(analyze_sentiments_batch(["Great", "bad service"]))
+    results = asyncio.run(analyze_sentiments_batch(["bad service", "Great"]))
+    assert results == [("negative", 0.8), ("positive", 0.9)]
+    assert len(completion.prompts) == 1
+
+
+def test_chunk_with_missing_answers_is_discarded_and_not_cached(completion):
+    completion.drop = 1
+    assert asyncio.run(analyze_sentiments_batch(["Great", "bad service"])) == [None, None]
+    assert sentiment_core._SENTIMENT_CACHE == {}
+
+
+def test_large_batch_of_short_reviews_is_fully_answered(completion):
+    reviews = [f"review {i}" for i in range(500)]
+    results = asyncio.run(analyze_sentiments_batch(reviews))
+    assert all(result == ("positive", 0.9) for result in results)
+    max_reviews = MAX_RESPONSE_TOKENS // TOKENS_PER_RESULT
+    assert len(completion.prompts) == -(-len(reviews) // max_reviews)
+
+
+def test_analyze_batch_reports_unanswered_reviews_as_bad_gateway(completion):
+    completion.drop = 1
+    response = TestClient(app).post("/analyze_batch", json={"reviews": ["Great", "bad service"]})
+    assert response.status_code == 502
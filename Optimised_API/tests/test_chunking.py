@@ -0,0 +1,47 @@
+from sentiment_core import chunk_reviews
+
+
+def test_every_review_is_placed_once():
+    token_counts = [5, 80, 30, 45, 10, 60, 25]
+    chunks = chunk_reviews(token_counts, 100)
+    placed = sorted(i for indices, _ in chunks for i in indices)
+    assert placed == list(range(len(token_counts)))
+
+
+def test_chunks_respect_budget_and_report_their_tokens():
+    token_counts = [5, 80, 30, 45, 10, 60, 25]
+    for indices, tokens in chunk_reviews(token_counts, 100):
+        assert tokens == sum(token_counts[i] for i in indices)
+        assert tokens <= 100
+
+
+def test_reviews_keep_their_original_order_within_a_chunk():
+    for indices, _ in chunk_reviews([10, 40, 20, 30, 5], 100):
+        assert indices == sorted(indices)
+
+
+def test_longest_first_packing_uses_fewer_chunks_than_in_order_filling():
+    # Filling in order gives [60], [50, 40], [50] while longest first gives [60, 40], [50, 50]
+    chunks = chunk_reviews([60, 50, 40, 50], 100)
+    assert sorted(indices for indices, _ in chunks) == [[0, 2], [1, 3]]
+
+
+def test_oversized_review_gets_its_own_chunk():
+    chunks = chunk_reviews([150, 10, 20], 100)
+    assert ([0], 150) in chunks
+    assert len(chunks) == 2
+
+
+def test_many_tiny_reviews_are_split_by_the_review_cap():
+    chunks = chunk_reviews([3] * 1000, 30000, max_reviews=200)
+    assert len(chunks) == 5
+    assert all(len(indices) == 200 for indices, _ in chunks)
+
+
+def test_review_cap_of_one_gives_a_chunk_per_review():
+    chunks = chunk_reviews([10, 20, 30], 100, max_reviews=1)
+    assert sorted(indices for indices, _ in chunks) == [[0], [1], [2]]
+
+
+def test_no_reviews_gives_no_chunks():
+    assert chunk_reviews([], 100) == []
@@ -0,0 +1,22 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from main_app import app
+
+client = TestClient(app)
+
+
+@pytest.mark.parametrize("filename, content", [
+    ("bad.xlsx", b"not an xlsx file"),
+    ("empty.csv", b""),
+    ("header.csv", b"review\n"),
+])
+def test_analyze_file_rejects_files_without_reviews(filename, content):
+    response = client.post("/analyze_file", files={"file": (filename, content)})
+    assert response.status_code == 400
+    assert response.json()["detail"]
+
+
+def test_analyze_file_rejects_other_formats():
+    response = client.post("/analyze_file", files={"file": ("reviews.txt", b"Great product\n")})
+    assert response.status_code == 400
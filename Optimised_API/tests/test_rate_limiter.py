@@ -0,0 +1,136 @@
+import asyncio
+import time
+
+import pytest
+
+from sentiment_core import RateLimiter, _parse_duration, groq_client
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2m59.56s", 179.56),
+    ("7.66s", 7.66),
+    ("120ms", 0.12),
+    ("1h", 3600.0),
+    ("7", 7.0),
+])
+def test_parse_duration(value, expected):
+    assert _parse_duration(value) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("value", [None, "", "soon"])
+def test_parse_duration_invalid(value):
+    assert _parse_duration(value) is None
+
+
+def test_no_delay_without_limits():
+    limiter = RateLimiter()
+    for _ in range(100):
+        asyncio.run(limiter.wait_if_throttled(1000))
+    assert limiter._get_delay(1000, time.monotonic()) <= 0
+
+
+def test_request_window_delays_until_oldest_request_expires():
+    limiter = RateLimiter(requests_per_minute=2)
+    asyncio.run(limiter.wait_if_throttled(10))
+    asyncio.run(limiter.wait_if_throttled(10))
+    now = time.monotonic()
+    assert limiter._get_delay(10, now) == pytest.approx(RateLimiter.WINDOW_SECONDS, abs=1)
+    assert limiter._get_delay(10, now + RateLimiter.WINDOW_SECONDS) <= 0
+
+
+def test_token_window_delays_requests_over_budget():
+    limiter = RateLimiter(tokens_per_minute=100)
+    asyncio.run(limiter.wait_if_throttled(80))
+    now = time.monotonic()
+    assert limiter._get_delay(20, now) <= 0
+    assert limiter._get_delay(30, now) > 0
+    assert limiter._get_delay(30, now + RateLimiter.WINDOW_SECONDS) <= 0
+
+
+def test_request_larger_than_token_limit_is_allowed_on_empty_window():
+    limiter = RateLimiter(tokens_per_minute=100)
+    assert limiter._get_delay(500, time.monotonic()) <= 0
+
+
+def test_headers_delay_until_token_reset():
+    limiter = RateLimiter()
+    limiter.update_from_headers({
+        "x-ratelimit-limit-tokens": "5000",
+        "x-ratelimit-remaining-tokens": "0",
+        "x-ratelimit-reset-tokens": "2s",
+    })
+    now = time.monotonic()
+    assert limiter.tokens_per_minute == 5000
+    assert limiter._get_delay(10, now) == pytest.approx(2, abs=0.5)
+    assert limiter._get_delay(10, now + 3) <= 0
+
+
+def test_headers_delay_until_retry_after():
+    limiter = RateLimiter()
+    limiter.update_from_headers({"retry-after": "5"})
+    now = time.monotonic()
+    assert limiter._get_delay(10, now) == pytest.approx(5, abs=0.5)
+    assert limiter._get_delay(10, now + 6) <= 0
+
+
+def test_concurrency_is_halved_when_throttled_and_grows_back():
+    limiter = RateLimiter(max_concurrency=8)
+
+    async def run():
+        await limiter.acquire(10)
+        await limiter.release(throttled=True)
+        assert limiter.concurrency == 4
+        await limiter.acquire(10)
+        await limiter.release(throttled=True)
+        assert limiter.concurrency == 2
+        for _ in range(10):
+            await limiter.acquire(10)
+            await limiter.release()
+        assert limiter.concurrency == 8
+
+    asyncio.run(run())
+
+
+def test_acquire_caps_requests_in_flight():
+    limiter = RateLimiter(max_concurrency=3)
+    in_flight = peak = 0
+
+    async def request():
+        nonlocal in_flight, peak
+        await limiter.acquire(10)
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        await limiter.release()
+
+    async def run():
+        await asyncio.gather(*(request() for _ in range(10)))
+
+    asyncio.run(run())
+    assert peak == 3
+
+
+def test_request_limit_is_split_between_processes():
+    limiter = RateLimiter(requests_per_minute=30, processes=4)
+    assert limiter.requests_per_window == 7
+    assert limiter.request_window_seconds == RateLimiter.WINDOW_SECONDS
+
+
+def test_more_processes_than_requests_per_minute_stays_within_the_limit():
+    # 4 processes sharing 2 requests per minute get one request every 2 minutes each
+    limiter = RateLimiter(requests_per_minute=2, processes=4)
+    asyncio.run(limiter.wait_if_throttled(10))
+    now = time.monotonic()
+    assert limiter._get_delay(10, now) == pytest.approx(2 * RateLimiter.WINDOW_SECONDS, abs=1)
+    assert limiter._get_delay(10, now + 2 * RateLimiter.WINDOW_SECONDS) <= 0
+
+
+def test_learnt_token_limit_is_split_between_processes():
+    limiter = RateLimiter(processes=4)
+    limiter.update_from_headers({"x-ratelimit-limit-tokens": "6000"})
+    assert limiter.tokens_per_minute == 1500
+
+
+def test_groq_client_leaves_retries_to_the_rate_limiter():
+    assert groq_client.max_retries == 0
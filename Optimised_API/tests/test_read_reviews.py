@@ -0,0 +1,60 @@
+import io
+
+import openpyxl
+import pytest
+
+from sentiment_core import read_reviews
+
+
+def xlsx_bytes(rows):
+    workbook = openpyxl.Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def test_csv_with_header_and_extra_columns():
+    content = b"review,rating\nGreat product,5\nToo expensive,2\n"
+    assert read_reviews(io.BytesIO(content), "reviews.csv") == ["Great product", "Too expensive"]
+
+
+def test_csv_without_header():
+    content = b"Great product\nToo expensive\n"
+    assert read_reviews(io.BytesIO(content), "reviews.csv") == ["Great product", "Too expensive"]
+
+
+@pytest.mark.parametrize("header", [b"Review", b"REVIEWS", b"\xef\xbb\xbfreview", b'" review "'])
+def test_csv_header_variants_are_removed(header):
+    content = header + b"\nGreat product\n"
+    assert read_reviews(io.BytesIO(content), "reviews.csv") == ["Great product"]
+
+
+def test_csv_empty_cells_are_skipped():
+    content = b"review,rating\nGreat product,5\n,3\nToo expensive,2\n"
+    assert read_reviews(io.BytesIO(content), "reviews.csv") == ["Great product", "Too expensive"]
+
+
+def test_csv_header_only_gives_no_reviews():
+    assert read_reviews(io.BytesIO(b"review\n"), "reviews.csv") == []
+
+
+def test_empty_csv_raises_value_error():
+    with pytest.raises(ValueError):
+        read_reviews(io.BytesIO(b""), "reviews.csv")
+
+
+def test_xlsx_with_header():
+    content = xlsx_bytes([["review", "rating"], ["Great product", 5], [42, 3]])
+    assert read_reviews(io.BytesIO(content), "reviews.xlsx") == ["Great product", "42"]
+
+
+def test_empty_xlsx_raises_value_error():
+    with pytest.raises(ValueError):
+        read_reviews(io.BytesIO(xlsx_bytes([])), "reviews.xlsx")
+
+
+def test_corrupt_xlsx_raises_value_error():
+    with pytest.raises(ValueError):
+        read_reviews(io.BytesIO(b"not an xlsx file"), "reviews.xlsx")